@@ -3,12 +3,14 @@ from datetime import datetime, timedelta
 import pytz
 import calendar as cal_module
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import and_, text
+from sqlalchemy import and_, or_, text
+from sqlalchemy.exc import IntegrityError
+import json
 import os
 from functools import wraps
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///duty_substitutions.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('APP_DATABASE_URI', 'sqlite:///duty_substitutions.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('APP_SECRET_KEY', 'change-me')
 db = SQLAlchemy(app)
@@ -57,6 +59,19 @@ TIMEZONE = pytz.timezone('Europe/Moscow')
 # 19 января 2026 - понедельник
 START_DATE = datetime(2026, 1, 19, tzinfo=TIMEZONE)
 
+# Через сколько записей журнала изменений сохранять снимок состояния
+SNAPSHOT_INTERVAL = 200
+
+# Максимальное число записей журнала в одном ответе API
+CHANGELOG_MAX_LIMIT = 1000
+
+# Максимальная длина диапазона дат для восстановления графика
+SCHEDULE_MAX_DAYS = 366
+
+# Порядок значений в компактном payload журнала
+SUBSTITUTION_LOG_FIELDS = ('id', 'original_employee_id', 'substitute_employee_id', 'reason')
+PROFILE_LOG_FIELDS = ('name', 'telegram', 'band', 'band_url')
+
 
 # Модель БД для замен дежурных
 class DutySubstitution(db.Model):
@@ -94,9 +109,229 @@ class EmployeeProfile(db.Model):
             'band_url': self.band_url
         }
 
-def get_employees():
-    """Возвращает список сотрудников с учетом профилей из БД"""
-    profiles = {p.id: p for p in EmployeeProfile.query.all()}
+class DutyChangeLog(db.Model):
+    """Журнал изменений замен и профилей (записи только добавляются)"""
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)  # Время MSK
+    entity = db.Column(db.String(12), nullable=False)  # 'substitution' или 'profile'
+    action = db.Column(db.String(6), nullable=False)  # 'create', 'update' или 'delete'
+    key = db.Column(db.String(20), nullable=False)  # duty_type для замены, id сотрудника для профиля
+    date = db.Column(db.Date)  # Дата замены (для профилей пусто)
+    payload = db.Column(db.Text)  # Компактный JSON-массив значений полей
+
+    __table_args__ = (
+        db.Index('ix_duty_change_log_date_created_at', 'date', 'created_at'),
+    )
+
+    def values(self):
+        return json.loads(self.payload) if self.payload else None
+
+    def to_dict(self):
+        fields = SUBSTITUTION_LOG_FIELDS if self.entity == 'substitution' else PROFILE_LOG_FIELDS
+        values = self.values()
+        return {
+            'id': self.id,
+            'created_at': msk_isoformat(self.created_at),
+            'entity': self.entity,
+            'action': self.action,
+            'key': self.key,
+            'date': self.date.isoformat() if self.date else None,
+            'data': dict(zip(fields, values)) if values else None
+        }
+
+
+class DutyScheduleSnapshot(db.Model):
+    """Снимок состояния замен и профилей после записи журнала last_entry_id"""
+    id = db.Column(db.Integer, primary_key=True)
+    last_entry_id = db.Column(db.Integer, nullable=False, unique=True)
+    taken_at = db.Column(db.DateTime, nullable=False)  # created_at записи last_entry_id
+    profiles = db.Column(db.Text, nullable=False)  # Компактный JSON {id сотрудника: значения полей}
+
+
+class DutyScheduleSnapshotRow(db.Model):
+    """Замена в составе снимка (строки по датам, чтобы читать только нужный диапазон)"""
+    id = db.Column(db.Integer, primary_key=True)
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('duty_schedule_snapshot.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    duty_type = db.Column(db.String(10), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # Компактный JSON-массив значений полей
+
+    __table_args__ = (
+        db.Index('ix_duty_schedule_snapshot_row_snapshot_date', 'snapshot_id', 'date'),
+    )
+
+
+def now_msk():
+    """Текущее время MSK без tzinfo (в таком виде время хранится в журнале)"""
+    return datetime.now(TIMEZONE).replace(tzinfo=None)
+
+
+def dump_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def msk_isoformat(value):
+    """ISO-строка для времени MSK без tzinfo, с явным смещением +03:00"""
+    return TIMEZONE.localize(value).isoformat()
+
+
+def to_msk(value):
+    """Переводит наивное локальное время сервера (datetime.now) в MSK без tzinfo"""
+    return value.astimezone(TIMEZONE).replace(tzinfo=None)
+
+
+def log_change(entity, action, key, values, date=None, created_at=None):
+    """Добавляет запись в журнал изменений (коммит делает вызывающий код)"""
+    entry = DutyChangeLog(
+        created_at=created_at or now_msk(),
+        entity=entity,
+        action=action,
+        key=key,
+        date=date,
+        payload=dump_json(list(values))
+    )
+    db.session.add(entry)
+    return entry
+
+
+def log_substitution_change(action, substitution, created_at=None):
+    return log_change(
+        'substitution',
+        action,
+        substitution.duty_type,
+        [getattr(substitution, field) for field in SUBSTITUTION_LOG_FIELDS],
+        date=substitution.date,
+        created_at=created_at
+    )
+
+
+def log_profile_change(action, profile):
+    return log_change(
+        'profile',
+        action,
+        profile.id,
+        [getattr(profile, field) for field in PROFILE_LOG_FIELDS]
+    )
+
+
+def empty_schedule_state():
+    return {'substitutions': {}, 'profiles': {}}
+
+
+def apply_change(state, entry):
+    """Применяет запись журнала к состоянию"""
+    if entry.entity == 'substitution':
+        bucket, key = state['substitutions'], (entry.date, entry.key)
+    else:
+        bucket, key = state['profiles'], entry.key
+    if entry.action == 'delete':
+        bucket.pop(key, None)
+    else:
+        bucket[key] = entry.values()
+
+
+def save_schedule_snapshot(state, last_entry):
+    """Сохраняет состояние как снимок после записи журнала last_entry (коммит делает вызывающий код)"""
+    snapshot = DutyScheduleSnapshot(
+        last_entry_id=last_entry.id,
+        taken_at=last_entry.created_at,
+        profiles=dump_json(state['profiles'])
+    )
+    db.session.add(snapshot)
+    db.session.flush()
+    db.session.add_all([
+        DutyScheduleSnapshotRow(
+            snapshot_id=snapshot.id,
+            date=date,
+            duty_type=duty_type,
+            payload=dump_json(values)
+        )
+        for (date, duty_type), values in state['substitutions'].items()
+    ])
+    return snapshot
+
+
+def load_schedule_state(snapshot, start_date=None, end_date=None):
+    """Восстанавливает состояние из снимка, при необходимости только для диапазона дат"""
+    if snapshot is None:
+        return empty_schedule_state()
+    query = DutyScheduleSnapshotRow.query.filter(DutyScheduleSnapshotRow.snapshot_id == snapshot.id)
+    if start_date:
+        query = query.filter(DutyScheduleSnapshotRow.date >= start_date)
+    if end_date:
+        query = query.filter(DutyScheduleSnapshotRow.date <= end_date)
+    substitutions = {(row.date, row.duty_type): json.loads(row.payload) for row in query.all()}
+    return {'substitutions': substitutions, 'profiles': json.loads(snapshot.profiles)}
+
+
+def get_schedule_state(as_of, start_date=None, end_date=None):
+    """
+    Состояние замен и профилей на момент as_of (время MSK без tzinfo)
+    Момент переводится в последний id журнала с created_at <= as_of: время записей
+    может идти не по порядку id (параллельные запросы, перевод часов), а снимки
+    и переигровка должны охватывать один и тот же набор записей.
+    Берется ближайший снимок не позже этого id, поверх него применяются
+    только более поздние записи журнала
+    """
+    cutoff_id = db.session.query(db.func.max(DutyChangeLog.id)).filter(
+        DutyChangeLog.created_at <= as_of
+    ).scalar() or 0
+    snapshot = DutyScheduleSnapshot.query.filter(
+        DutyScheduleSnapshot.last_entry_id <= cutoff_id
+    ).order_by(DutyScheduleSnapshot.last_entry_id.desc()).first()
+    state = load_schedule_state(snapshot, start_date, end_date)
+
+    query = DutyChangeLog.query.filter(
+        DutyChangeLog.id > (snapshot.last_entry_id if snapshot else 0),
+        DutyChangeLog.id <= cutoff_id
+    )
+    if start_date and end_date:
+        query = query.filter(or_(
+            DutyChangeLog.entity == 'profile',
+            and_(DutyChangeLog.date >= start_date, DutyChangeLog.date <= end_date)
+        ))
+    for entry in query.order_by(DutyChangeLog.id).all():
+        apply_change(state, entry)
+    return state
+
+
+def maybe_take_snapshot():
+    """
+    Сохраняет снимок, если с прошлого накопилось SNAPSHOT_INTERVAL записей
+    Снимок - только оптимизация, поэтому его ошибки не должны ломать запрос
+    """
+    try:
+        last_entry_id = db.session.query(
+            db.func.max(DutyScheduleSnapshot.last_entry_id)
+        ).scalar() or 0
+        pending = DutyChangeLog.query.filter(DutyChangeLog.id > last_entry_id).count()
+        if pending < SNAPSHOT_INTERVAL:
+            return None
+
+        last_snapshot = DutyScheduleSnapshot.query.filter_by(last_entry_id=last_entry_id).first()
+        state = load_schedule_state(last_snapshot)
+        entries = DutyChangeLog.query.filter(
+            DutyChangeLog.id > last_entry_id
+        ).order_by(DutyChangeLog.id).all()
+        for entry in entries:
+            apply_change(state, entry)
+        snapshot = save_schedule_snapshot(state, entries[-1])
+        db.session.commit()
+        return snapshot
+    except IntegrityError:
+        # Параллельный запрос уже сохранил снимок с тем же last_entry_id
+        db.session.rollback()
+        return None
+    except Exception:
+        app.logger.exception('Не удалось сохранить снимок журнала изменений')
+        db.session.rollback()
+        return None
+
+
+def get_employees(profiles=None):
+    """Возвращает список сотрудников с учетом профилей из БД (или переданных профилей)"""
+    if profiles is None:
+        profiles = {p.id: p for p in EmployeeProfile.query.all()}
     employees = []
     for emp in EMPLOYEE_DEFAULTS:
         profile = profiles.get(emp['id'])
@@ -139,7 +374,7 @@ def get_week_number(date):
     return delta.days // 7
 
 
-def get_duty_for_week(week_num):
+def get_duty_for_week(week_num, employees=None):
     """
     Определяет Primary и Secondary для недели
     Ротация без нахлестов: каждый человек не может быть Primary на одной неделе
@@ -165,7 +400,8 @@ def get_duty_for_week(week_num):
     ]
     
     primary_idx, secondary_idx = rotation[pattern]
-    employees = get_employees()
+    if employees is None:
+        employees = get_employees()
     return employees[primary_idx], employees[secondary_idx]
 
 
@@ -179,10 +415,13 @@ def get_duty_for_date(date, check_substitutions=True, substitutions_map=None, em
     weekday = date.weekday()
     week_num = get_week_number(date)
     
-    # Получаем базовых дежурных для недели
-    week_primary, week_secondary = get_duty_for_week(week_num)
     if employees_map is None:
         employees_map = get_employee_map()
+    # Получаем базовых дежурных для недели
+    week_primary, week_secondary = get_duty_for_week(
+        week_num,
+        [employees_map[e['id']] for e in EMPLOYEE_DEFAULTS]
+    )
     
     # Проверяем замены в БД
     if check_substitutions:
@@ -335,6 +574,72 @@ def get_calendar_month(year, month, substitutions_map=None, employees_map=None):
     return calendar_data
 
 
+def build_schedule_as_of(as_of, start_date, end_date):
+    """Восстанавливает фактический график дежурств на момент as_of для диапазона дат"""
+    state = get_schedule_state(as_of, start_date, end_date)
+
+    profiles = {
+        employee_id: EmployeeProfile(id=employee_id, **dict(zip(PROFILE_LOG_FIELDS, values)))
+        for employee_id, values in state['profiles'].items()
+    }
+    employees_map = {e['id']: e for e in get_employees(profiles)}
+
+    substitutions_map = {}
+    for (date, duty_type), values in state['substitutions'].items():
+        substitutions_map.setdefault(date, {})[duty_type] = DutySubstitution(
+            date=date,
+            duty_type=duty_type,
+            **dict(zip(SUBSTITUTION_LOG_FIELDS, values))
+        )
+
+    schedule = []
+    current_date = start_date
+    while current_date <= end_date:
+        date_obj = datetime.combine(current_date, datetime.min.time()).replace(tzinfo=TIMEZONE)
+        primary, secondary = get_duty_for_date(
+            date_obj,
+            substitutions_map=substitutions_map,
+            employees_map=employees_map
+        )
+        day_subs = substitutions_map.get(current_date, {})
+        schedule.append({
+            'date': current_date.isoformat(),
+            'primary': primary['name'] if primary else None,
+            'primary_id': primary['id'] if primary else None,
+            'secondary': secondary['name'] if secondary else None,
+            'secondary_id': secondary['id'] if secondary else None,
+            'substitutions': [day_subs[t].to_dict() for t in ('primary', 'secondary') if t in day_subs]
+        })
+        current_date += timedelta(days=1)
+    return schedule
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value).date()
+
+
+def parse_request_args(**parsers):
+    """Разбирает параметры запроса, возвращает (значения, ответ с ошибкой или None)"""
+    values = {}
+    for name, parser in parsers.items():
+        value = request.args.get(name)
+        try:
+            values[name] = parser(value) if value else None
+        except ValueError:
+            return None, (jsonify({'error': f'Неверный формат параметра {name}: {value}'}), 400)
+    return values, None
+
+
+def parse_as_of(value):
+    """Разбирает момент времени из запроса в MSK без tzinfo (по умолчанию - сейчас)"""
+    if not value:
+        return now_msk()
+    as_of = datetime.fromisoformat(value)
+    if as_of.tzinfo:
+        as_of = as_of.astimezone(TIMEZONE).replace(tzinfo=None)
+    return as_of
+
+
 @app.route('/')
 def index():
     """Главная страница с информацией о текущих дежурных"""
@@ -492,16 +797,20 @@ def update_employee(employee_id):
         return jsonify({'error': 'Сотрудник не найден'}), 404
 
     profile = EmployeeProfile.query.get(employee_id)
+    action = 'update'
     if not profile:
         profile = EmployeeProfile(id=employee_id)
         db.session.add(profile)
+        action = 'create'
 
     profile.name = data.get('name', profile.name)
     profile.telegram = data.get('telegram', profile.telegram)
     profile.band = data.get('band', profile.band)
     profile.band_url = data.get('band_url', profile.band_url)
 
+    log_profile_change(action, profile)
     db.session.commit()
+    maybe_take_snapshot()
     return jsonify(profile.to_dict())
 
 
@@ -588,6 +897,7 @@ def create_substitution():
             existing.substitute_employee_id = substitute_employee_id
             existing.original_employee_id = original_employee_id
             existing.reason = reason
+            log_substitution_change('update', existing)
             created_substitutions.append(existing)
         else:
             # Создаем новую замену
@@ -599,11 +909,14 @@ def create_substitution():
                 reason=reason
             )
             db.session.add(substitution)
+            db.session.flush()  # Нужен id для журнала
+            log_substitution_change('create', substitution)
             created_substitutions.append(substitution)
         
         current_date += timedelta(days=1)
     
     db.session.commit()
+    maybe_take_snapshot()
     
     if not created_substitutions:
         return jsonify({
@@ -622,11 +935,64 @@ def create_substitution():
 def delete_substitution(sub_id):
     """Удалить замену"""
     substitution = DutySubstitution.query.get_or_404(sub_id)
+    log_substitution_change('delete', substitution)
     db.session.delete(substitution)
     db.session.commit()
+    maybe_take_snapshot()
     return jsonify({'message': 'Замена удалена'}), 200
 
 
+@app.route('/api/changelog', methods=['GET'])
+@login_required
+def get_changelog():
+    """
+    Журнал изменений замен и профилей
+    Фильтры start_date/end_date относятся к датам замен, изменения профилей остаются в выдаче
+    """
+    args, error = parse_request_args(since=parse_as_of, until=parse_as_of, start_date=parse_date, end_date=parse_date)
+    if error:
+        return error
+
+    query = DutyChangeLog.query
+    if args['since']:
+        query = query.filter(DutyChangeLog.created_at >= args['since'])
+    if args['until']:
+        query = query.filter(DutyChangeLog.created_at <= args['until'])
+    if args['start_date']:
+        query = query.filter(or_(DutyChangeLog.entity == 'profile', DutyChangeLog.date >= args['start_date']))
+    if args['end_date']:
+        query = query.filter(or_(DutyChangeLog.entity == 'profile', DutyChangeLog.date <= args['end_date']))
+    if request.args.get('entity'):
+        query = query.filter(DutyChangeLog.entity == request.args['entity'])
+
+    limit = max(1, min(request.args.get('limit', 500, type=int), CHANGELOG_MAX_LIMIT))
+    entries = query.order_by(DutyChangeLog.id.desc()).limit(limit).all()
+    return jsonify([e.to_dict() for e in entries])
+
+
+@app.route('/api/schedule', methods=['GET'])
+@login_required
+def get_schedule():
+    """Фактический график дежурств на момент as_of (по умолчанию - сейчас)"""
+    args, error = parse_request_args(as_of=parse_as_of, start_date=parse_date, end_date=parse_date)
+    if error:
+        return error
+    as_of = args['as_of'] or now_msk()
+    start_date = args['start_date'] or as_of.date()
+    end_date = args['end_date'] or start_date + timedelta(days=6)
+    if end_date < start_date:
+        return jsonify({'error': 'end_date раньше start_date'}), 400
+    if (end_date - start_date).days + 1 > SCHEDULE_MAX_DAYS:
+        return jsonify({'error': f'Диапазон не может превышать {SCHEDULE_MAX_DAYS} дней'}), 400
+
+    return jsonify({
+        'as_of': msk_isoformat(as_of),
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'schedule': build_schedule_as_of(as_of, start_date, end_date)
+    })
+
+
 @app.route('/api/current')
 def api_current():
     """API endpoint для получения текущих дежурных"""
@@ -659,6 +1025,22 @@ with app.app_context():
     except Exception:
         # Если таблицы еще нет, create_all создаст её с нужными полями
         pass
+    # Журнал появился позже замен: фиксируем уже существующие данные как начальное состояние.
+    # Замены пишем со своим created_at и по возрастанию времени, чтобы порядок id совпадал с порядком времени;
+    # у профилей времени создания нет, поэтому они попадают в журнал на момент первого запуска
+    if DutyChangeLog.query.first() is None:
+        seed_time = now_msk()
+        substitutions = sorted(
+            ((to_msk(s.created_at) if s.created_at else seed_time, s) for s in DutySubstitution.query.all()),
+            key=lambda item: (item[0], item[1].id)
+        )
+        for created_at, substitution in substitutions:
+            log_substitution_change('create', substitution, created_at=min(created_at, seed_time))
+            db.session.flush()
+        for profile in EmployeeProfile.query.order_by(EmployeeProfile.id).all():
+            log_profile_change('create', profile)
+        db.session.commit()
+        maybe_take_snapshot()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+import os
+from datetime import datetime, timedelta
+
+# Тесты пересоздают таблицы, поэтому никогда не используем настроенную БД
+os.environ['APP_DATABASE_URI'] = 'sqlite://'
+
+import pytest
+
+import app as duty_app
+
+
+class FakeClock:
+    def __init__(self):
+        self.current = datetime(2026, 2, 1, 10, 0)
+
+    def __call__(self):
+        self.current += timedelta(minutes=1)
+        return self.current
+
+
+@pytest.fixture
+def client(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(duty_app, 'now_msk', clock)
+    monkeypatch.setattr(duty_app, 'SNAPSHOT_INTERVAL', 3)
+    with duty_app.app.app_context():
+        duty_app.db.drop_all()
+        duty_app.db.create_all()
+    client = duty_app.app.test_client()
+    with client.session_transaction() as session:
+        session['auth'] = True
+    client.clock = clock
+    return client
+
+
+def schedule(client, as_of):
+    response = client.get('/api/schedule', query_string={
+        'as_of': as_of.isoformat(),
+        'start_date': '2026-02-02',
+        'end_date': '2026-02-05'
+    })
+    assert response.status_code == 200
+    return {day['date']: day['primary'] for day in response.json['schedule']}
+
+
+def test_schedule_as_of_replays_across_snapshots(client):
+    # Неделя 2 ротации (2-8 февраля): P: Павел, S: Максим
+    baseline = schedule(client, client.clock.current)
+    assert baseline == {
+        '2026-02-02': 'Павел Аминов',
+        '2026-02-03': 'Павел Аминов',
+        '2026-02-04': 'Павел Аминов',
+        '2026-02-05': 'Павел Аминов',
+    }
+
+    created = client.post('/api/substitutions', json={
+        'start_date': '2026-02-02',
+        'end_date': '2026-02-04',
+        'duty_type': 'primary',
+        'substitute_employee_id': 'sergey'
+    })
+    assert created.status_code == 201
+    after_create = client.clock.current
+
+    client.post('/api/substitutions', json={
+        'start_date': '2026-02-03',
+        'end_date': '2026-02-05',
+        'duty_type': 'primary',
+        'substitute_employee_id': 'maxim'
+    })
+    after_update = client.clock.current
+
+    client.put('/api/employees/sergey', json={'name': 'Сергей П.'})
+    after_rename = client.clock.current
+
+    client.delete(f"/api/substitutions/{created.json['created'][0]['id']}")
+    after_delete = client.clock.current
+
+    with duty_app.app.app_context():
+        assert duty_app.DutyScheduleSnapshot.query.count() == 2
+
+    expected = {
+        after_create: {
+            '2026-02-02': 'Сергей Петухов',
+            '2026-02-03': 'Сергей Петухов',
+            '2026-02-04': 'Сергей Петухов',
+            '2026-02-05': 'Павел Аминов',
+        },
+        after_update: {
+            '2026-02-02': 'Сергей Петухов',
+            '2026-02-03': 'Максим Огурцов',
+            '2026-02-04': 'Максим Огурцов',
+            '2026-02-05': 'Максим Огурцов',
+        },
+        after_rename: {
+            '2026-02-02': 'Сергей П.',
+            '2026-02-03': 'Максим Огурцов',
+            '2026-02-04': 'Максим Огурцов',
+            '2026-02-05': 'Максим Огурцов',
+        },
+        after_delete: {
+            '2026-02-02': 'Павел Аминов',
+            '2026-02-03': 'Максим Огурцов',
+            '2026-02-04': 'Максим Огурцов',
+            '2026-02-05': 'Максим Огурцов',
+        },
+    }
+    for as_of, days in expected.items():
+        assert schedule(client, as_of) == days
+    assert schedule(client, datetime(2026, 2, 1)) == baseline
+
+    # Без снимков полная переигровка журнала дает тот же результат
+    with duty_app.app.app_context():
+        duty_app.DutyScheduleSnapshotRow.query.delete()
+        duty_app.DutyScheduleSnapshot.query.delete()
+        duty_app.db.session.commit()
+    for as_of, days in expected.items():
+        assert schedule(client, as_of) == days
+
+
+def test_changelog_keeps_profiles_under_date_filter_and_bounds_limit(client):
+    client.put('/api/employees/sergey', json={'name': 'Сергей П.'})
+    client.post('/api/substitutions', json={
+        'start_date': '2026-02-02',
+        'end_date': '2026-02-03',
+        'duty_type': 'primary',
+        'substitute_employee_id': 'sergey'
+    })
+
+    entries = client.get('/api/changelog', query_string={
+        'entity': 'profile',
+        'start_date': '2026-02-03'
+    }).json
+    assert [e['key'] for e in entries] == ['sergey']
+
+    entries = client.get('/api/changelog', query_string={'limit': -1}).json
+    assert len(entries) == 1
+
+    response = client.get('/api/changelog', query_string={'start_date': 'bad'})
+    assert response.status_code == 400
+    assert 'start_date' in response.json['error']
+
+
+def test_schedule_range_is_capped(client):
+    response = client.get('/api/schedule', query_string={
+        'start_date': '2026-01-01',
+        'end_date': '2027-12-31'
+    })
+    assert response.status_code == 400
+
+
+def test_snapshot_and_replay_agree_when_created_at_is_out_of_order(client, monkeypatch):
+    monkeypatch.setattr(duty_app, 'SNAPSHOT_INTERVAL', 2)
+
+    # Запись с большим id получает более раннее время (параллельные запросы, перевод часов)
+    client.clock.current = datetime(2026, 2, 1, 10, 1)
+    client.post('/api/substitutions', json={
+        'start_date': '2026-02-02',
+        'duty_type': 'primary',
+        'substitute_employee_id': 'sergey'
+    })
+    client.clock.current = datetime(2026, 2, 1, 10, 0)
+    client.post('/api/substitutions', json={
+        'start_date': '2026-02-02',
+        'duty_type': 'secondary',
+        'substitute_employee_id': 'sergey'
+    })
+
+    def substitutions(as_of):
+        response = client.get('/api/schedule', query_string={
+            'as_of': as_of.isoformat(),
+            'start_date': '2026-02-02',
+            'end_date': '2026-02-02'
+        })
+        return [s['duty_type'] for s in response.json['schedule'][0]['substitutions']]
+
+    as_of = datetime(2026, 2, 1, 10, 1, 30)
+    with duty_app.app.app_context():
+        assert duty_app.DutyScheduleSnapshot.query.count() == 1
+    with_snapshot = substitutions(as_of)
+
+    with duty_app.app.app_context():
+        duty_app.DutyScheduleSnapshotRow.query.delete()
+        duty_app.DutyScheduleSnapshot.query.delete()
+        duty_app.db.session.commit()
+    assert substitutions(as_of) == with_snapshot == ['primary', 'secondary']
+
+
+def test_snapshot_failure_is_logged_and_does_not_fail_request(client, monkeypatch, caplog):
+    def broken_snapshot(state, last_entry):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(duty_app, 'SNAPSHOT_INTERVAL', 1)
+    monkeypatch.setattr(duty_app, 'save_schedule_snapshot', broken_snapshot)
+    response = client.put('/api/employees/sergey', json={'name': 'Сергей П.'})
+
+    assert response.status_code == 200
+    assert 'Не удалось сохранить снимок' in caplog.text
+
+
+def test_times_are_returned_with_msk_offset(client):
+    client.put('/api/employees/sergey', json={'name': 'Сергей П.'})
+
+    response = client.get('/api/schedule', query_string={'as_of': '2026-02-01T07:00:00+00:00'})
+    assert response.json['as_of'] == '2026-02-01T10:00:00+03:00'
+
+    entries = client.get('/api/changelog').json
+    assert entries[0]['created_at'] == '2026-02-01T10:01:00+03:00'